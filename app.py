@@ -1,13 +1,24 @@
 import os
+import hmac
 import logging
+import threading
 import json
-from flask import Flask, render_template, request, jsonify
+from datetime import datetime, timezone
+import click
+from flask import Flask, render_template, request, jsonify, abort
+from sqlalchemy import func
 from headache_rag import HeadacheRAG
 from knowledge_base import MedicalKnowledgeBase
-from models import db, HeadacheRecord
+from models import db, HeadacheRecord, HeadacheArchive
+from schema import missing_schema_changes, upgrade_schema
+from search import init_search_index, search_index_exists, search_records, SearchIndexMissing
+from archive import archive_old_records, load_archived_records
+from episode_index import EpisodeIndex
+from profiling import init_profiling
+from http_cache import init_http_cache, history_validators, is_not_modified, set_validators
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging (set LOG_LEVEL=DEBUG for verbose output during development)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Create Flask app
@@ -25,6 +36,12 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 db.init_app(app)
 
+# Static asset fingerprinting, cache headers and response compression
+init_http_cache(app)
+
+# Opt-in request profiling (see PROFILE_SAMPLE_RATE and SLOW_REQUEST_MS)
+profiler = init_profiling(app)
+
 # Create database tables immediately
 with app.app_context():
     try:
@@ -32,10 +49,88 @@ with app.app_context():
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.error(f"Error creating database tables: {str(e)}")
+    
+    try:
+        missing = missing_schema_changes()
+        if missing:
+            logger.warning(f"Database schema is out of date (missing {', '.join(missing)}), "
+                           f"run 'flask upgrade-db' to update it")
+    except Exception as e:
+        logger.error(f"Error checking database schema: {str(e)}")
+    
+    try:
+        if not search_index_exists():
+            logger.warning("Full-text search index not found, run 'flask init-search-index' to create it")
+    except Exception as e:
+        logger.error(f"Error checking full-text search index: {str(e)}")
 
 # Initialize the knowledge base and RAG system
 knowledge_base = MedicalKnowledgeBase()
-headache_rag = HeadacheRAG(knowledge_base)
+episode_index = EpisodeIndex()
+
+def _build_episode_index():
+    """Build the similar-episodes index from the table, off the request path"""
+    with app.app_context():
+        try:
+            episode_index.rebuild()
+        except Exception as e:
+            logger.error(f"Error building episode index: {str(e)}")
+
+threading.Thread(target=_build_episode_index, name="episode-index-build", daemon=True).start()
+
+def find_similar_episodes(symptoms, top_k=3, exclude_id=None):
+    """
+    Find the stored headache records whose symptoms are most similar
+    
+    Returns no episodes until the index has finished its initial build.
+    
+    Args:
+        symptoms: Symptoms text to compare against
+        top_k: Number of episodes to return
+        exclude_id: Optional record id to leave out
+        
+    Returns:
+        List of episode dictionaries, most similar first
+    """
+    if not episode_index.built:
+        return []
+    
+    # Pick up records inserted by other workers
+    episode_index.catch_up()
+    
+    episodes = []
+    for _ in range(2):
+        matches = episode_index.search(symptoms, top_k, exclude_id=exclude_id)
+        if not matches:
+            return []
+        
+        records = HeadacheRecord.query.filter(HeadacheRecord.id.in_([record_id for record_id, _ in matches])).all()
+        records_by_id = {record.id: record for record in records}
+        
+        # Records archived or deleted by another process are dropped from the index
+        missing = [record_id for record_id, _ in matches if record_id not in records_by_id]
+        if missing:
+            episode_index.remove(missing)
+        
+        episodes = []
+        for record_id, similarity in matches:
+            record = records_by_id.get(record_id)
+            if record is None:
+                continue
+            episodes.append({
+                "id": record.id,
+                "symptoms": record.symptoms,
+                "diagnosis": record.diagnosis,
+                "created_at": record.created_at.isoformat(),
+                "similarity": round(similarity, 4)
+            })
+        
+        # Search once more if stale entries took some of the top k slots
+        if not missing:
+            break
+    return episodes
+
+headache_rag = HeadacheRAG(knowledge_base, episode_lookup=find_similar_episodes)
 
 @app.route("/")
 def index():
@@ -61,7 +156,7 @@ def analyze_symptoms():
             return jsonify({"error": "No symptoms provided"}), 400
         
         # Process with RAG system
-        diagnosis, recommendations = headache_rag.analyze_headache(symptoms_text)
+        diagnosis, recommendations, tier = headache_rag.analyze_headache(symptoms_text)
         
         # Save the analysis to the database
         record_id = None
@@ -70,11 +165,13 @@ def analyze_symptoms():
                 symptoms=symptoms_text,
                 diagnosis=diagnosis,
                 recommendations=json.dumps(recommendations),
-                used_fallback=False
+                used_fallback=tier == "fallback",
+                tier=tier
             )
             db.session.add(record)
             db.session.commit()
             record_id = record.id
+            episode_index.add(record_id, symptoms_text)
         except Exception as db_error:
             logger.error(f"Error saving primary analysis to database: {str(db_error)}")
             # Make sure to rollback the session
@@ -86,6 +183,7 @@ def analyze_symptoms():
         return jsonify({
             "diagnosis": diagnosis,
             "recommendations": recommendations,
+            "tier": tier,
             "record_id": record_id
         })
     
@@ -115,11 +213,13 @@ def analyze_symptoms():
                     symptoms=symptoms_text,
                     diagnosis=fallback_diagnosis,
                     recommendations=json.dumps(fallback_recommendations),
-                    used_fallback=True
+                    used_fallback=True,
+                    tier="fallback"
                 )
                 db.session.add(record)
                 db.session.commit()
                 record_id = record.id
+                episode_index.add(record_id, symptoms_text)
         except Exception as db_error:
             logger.error(f"Error saving to database: {str(db_error)}")
             # Make sure to rollback the session to avoid future errors
@@ -136,37 +236,83 @@ def analyze_symptoms():
             "diagnosis": fallback_diagnosis,
             "recommendations": fallback_recommendations,
             "using_fallback": True,
+            "tier": "fallback",
             "record_id": record_id
         }), 200
 
+def _parse_datetime_arg(name):
+    """
+    Parse an optional ISO date/datetime query argument (raises ValueError if malformed)
+    
+    Values with a UTC offset are converted to naive UTC to match the stored timestamps.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 @app.route("/api/history", methods=["GET"])
 def get_headache_history():
-    """API endpoint to get the history of headache records as JSON"""
+    """
+    API endpoint to get the history of headache records as JSON
+    
+    Optional query arguments: start (inclusive) and end (exclusive) ISO dates to
+    limit the range, and include_archived=1 to also return archived records.
+    """
     try:
+        try:
+            start = _parse_datetime_arg("start")
+            end = _parse_datetime_arg("end")
+        except ValueError:
+            return jsonify({"error": "start and end must be ISO dates"}), 400
+        include_archived = request.args.get("include_archived", "").lower() in ("1", "true", "yes")
+        
         # Create a fresh session context to avoid any transaction issues
         with app.app_context():
+            filters = []
+            if start is not None:
+                filters.append(HeadacheRecord.created_at >= start)
+            if end is not None:
+                filters.append(HeadacheRecord.created_at < end)
+            
+            # Answer from the validators alone when the client's copy is current
+            last_id, record_count, last_created_at = db.session.query(
+                func.max(HeadacheRecord.id),
+                func.count(HeadacheRecord.id),
+                func.max(HeadacheRecord.created_at)
+            ).filter(*filters).one()
+            
+            # Archiving changes the history even when no new records arrive
+            last_archive_id, archive_count, last_archived_at = db.session.query(
+                func.max(HeadacheArchive.id),
+                func.count(HeadacheArchive.id),
+                func.max(HeadacheArchive.archived_at)
+            ).one()
+            
+            scope = f"{start}:{end}" if filters else ""
+            if include_archived:
+                scope += f":archived-{last_archive_id or 0}-{archive_count}"
+            etag, last_modified = history_validators(
+                last_id, record_count, last_created_at, last_archived_at, scope
+            )
+            
+            if is_not_modified(etag, last_modified):
+                return set_validators(app.response_class(status=304), etag, last_modified)
+            
             # Get all records ordered by most recent first
-            records = HeadacheRecord.query.order_by(HeadacheRecord.created_at.desc()).all()
+            records = HeadacheRecord.query.filter(*filters).order_by(HeadacheRecord.created_at.desc()).all()
             
             # Format the records for JSON response
-            history = []
-            for record in records:
-                # Handle potential JSON parsing errors
-                try:
-                    recommendations = json.loads(record.recommendations)
-                except:
-                    recommendations = ["Error loading recommendations"]
-                
-                history.append({
-                    "id": record.id,
-                    "symptoms": record.symptoms,
-                    "diagnosis": record.diagnosis,
-                    "recommendations": recommendations,
-                    "created_at": record.created_at.isoformat(),
-                    "used_fallback": record.used_fallback
-                })
+            history = [record.to_dict() for record in records]
+            
+            # Archived records are all older than the hot table, so they go last
+            if include_archived:
+                history.extend(load_archived_records(start, end))
             
-            return jsonify({"history": history})
+            return set_validators(jsonify({"history": history}), etag, last_modified)
     
     except Exception as e:
         logger.error(f"Error getting history: {str(e)}")
@@ -177,10 +323,171 @@ def get_headache_history():
             pass
         return jsonify({"error": "Failed to retrieve headache history"}), 500
 
+@app.route("/api/history/search", methods=["GET"])
+def search_headache_history():
+    """API endpoint for ranked, paginated full-text search over symptoms and diagnoses"""
+    try:
+        query = request.args.get("q", "").strip()
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", 20, type=int), 1), 100)
+        
+        if not query:
+            return jsonify({"error": "No search query provided"}), 400
+        
+        with app.app_context():
+            results, has_more = search_records(query, page, per_page)
+            return jsonify({
+                "results": results,
+                "page": page,
+                "per_page": per_page,
+                "has_more": has_more
+            })
+    
+    except NotImplementedError:
+        return jsonify({"error": "Full-text search is not supported on this database"}), 501
+    
+    except SearchIndexMissing:
+        return jsonify({"error": "Full-text search index has not been created"}), 503
+    
+    except Exception as e:
+        logger.error(f"Error searching history: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return jsonify({"error": "Failed to search headache history"}), 500
+
+@app.route("/api/history/similar", methods=["GET"])
+def get_similar_episodes():
+    """API endpoint to find past headache records similar to the given symptoms or record"""
+    try:
+        symptoms_text = request.args.get("symptoms", "")
+        record_id = request.args.get("record_id", type=int)
+        top_k = min(max(request.args.get("k", 5, type=int), 1), 50)
+        
+        with app.app_context():
+            if record_id is not None:
+                record = db.session.get(HeadacheRecord, record_id)
+                if record is None:
+                    return jsonify({"error": "Record not found"}), 404
+                symptoms_text = record.symptoms
+            
+            if not symptoms_text:
+                return jsonify({"error": "No symptoms or record_id provided"}), 400
+            
+            if not episode_index.built:
+                return jsonify({"error": "Episode index is still building, try again shortly"}), 503
+            
+            episodes = find_similar_episodes(symptoms_text, top_k, exclude_id=record_id)
+            return jsonify({"episodes": episodes})
+    
+    except Exception as e:
+        logger.error(f"Error finding similar episodes: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return jsonify({"error": "Failed to find similar episodes"}), 500
+
+@app.route("/api/stats/tiers", methods=["GET"])
+def get_tier_stats():
+    """API endpoint reporting how often each inference tier answered and the LLM escalation rate"""
+    try:
+        with app.app_context():
+            rows = db.session.query(HeadacheRecord.tier, func.count(HeadacheRecord.id)) \
+                .group_by(HeadacheRecord.tier).all()
+            
+            # Records saved before tiering was introduced have no tier
+            counts = {tier or "unknown": count for tier, count in rows}
+            tiered_total = sum(count for tier, count in counts.items() if tier != "unknown")
+            
+            # Escalated requests are those that went on to retrieval + LLM,
+            # whether the LLM answered or failed and fell back
+            escalated = counts.get("llm", 0) + counts.get("fallback", 0)
+            escalation_rate = escalated / tiered_total if tiered_total else 0.0
+            
+            return jsonify({
+                "counts": counts,
+                "total": tiered_total,
+                "escalation_rate": round(escalation_rate, 4),
+                "confidence_threshold": headache_rag.confidence_threshold
+            })
+    
+    except Exception as e:
+        logger.error(f"Error getting tier stats: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return jsonify({"error": "Failed to retrieve tier statistics"}), 500
+
+def _require_admin():
+    """Abort unless the request carries the configured admin token"""
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    # Admin endpoints do not exist unless a token is configured
+    if not admin_token:
+        abort(404)
+    provided = request.headers.get("X-Admin-Token") or request.args.get("token", "")
+    if not hmac.compare_digest(provided, admin_token):
+        abort(403)
+
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
+    """Admin endpoint listing captured request profiles"""
+    _require_admin()
+    return jsonify({
+        "enabled": profiler.enabled,
+        "sample_rate": profiler.sample_rate,
+        "slow_request_ms": profiler.slow_request_ms,
+        "profiles": profiler.list_captures()
+    })
+
+@app.route("/admin/profiles/folded", methods=["GET"])
+@app.route("/admin/profiles/<int:capture_id>/folded", methods=["GET"])
+def download_profile(capture_id=None):
+    """Admin endpoint to download collapsed stacks for one profile or all of them, for flamegraph tools"""
+    _require_admin()
+    folded = profiler.folded(capture_id)
+    if folded is None:
+        return jsonify({"error": "Profile not found"}), 404
+    
+    filename = f"profile-{capture_id}.folded" if capture_id else "profiles.folded"
+    return app.response_class(folded, mimetype="text/plain", headers={
+        "Content-Disposition": f"attachment; filename={filename}"
+    })
+
 @app.route("/health")
 def health_check():
     """Simple health check endpoint"""
     return jsonify({"status": "healthy"})
 
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Add columns and indexes introduced after the database was created (safe to re-run)"""
+    added = upgrade_schema()
+    click.echo(f"Added {', '.join(added)}" if added else "Database schema is up to date")
+
+@app.cli.command("init-search-index")
+def init_search_index_command():
+    """Create the full-text search index (rewrites headache_record on PostgreSQL, run during maintenance)"""
+    init_search_index()
+    click.echo("Full-text search index is ready")
+
+@app.cli.command("archive-history")
+@click.option("--older-than-days", type=int, default=None, help="Archive records older than this many days")
+@click.option("--batch-size", type=int, default=None, help="Records moved per transaction")
+@click.option("--max-batches", type=int, default=None, help="Stop after this many batches")
+@click.option("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+def archive_history_command(older_than_days, batch_size, max_batches, pause):
+    """Move old headache records into compressed monthly archives"""
+    # Web workers drop archived records from their episode indexes when searches find them missing
+    archived = archive_old_records(
+        older_than_days=older_than_days,
+        batch_size=batch_size,
+        max_batches=max_batches,
+        pause=pause
+    )
+    click.echo(f"Archived {archived} records")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
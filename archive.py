@@ -0,0 +1,166 @@
+import os
+import gzip
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from models import db, HeadacheRecord, HeadacheArchive
+
+# zstd is optional - gzip is used when it is not installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+
+
+def _compress(data):
+    """
+    Compress archive payload bytes with the best available codec
+
+    Args:
+        data: Raw bytes
+
+    Returns:
+        Tuple of (codec name, compressed bytes)
+    """
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=9)
+
+
+def _decompress(codec, payload):
+    """
+    Decompress an archive payload
+
+    Args:
+        codec: Codec name stored with the payload
+        payload: Compressed bytes
+
+    Returns:
+        Raw bytes
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed archives")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+
+def archive_old_records(older_than_days=None, batch_size=None, max_batches=None, pause=0.0, on_archived=None):
+    """
+    Move records older than the retention age from the hot table into compressed archives
+
+    Each batch is archived and deleted in its own short transaction, so the job
+    never holds locks on the hot table for long and can be stopped and re-run at
+    any point without losing or duplicating records. Overlapping runs are safe:
+    on PostgreSQL each run locks its batch and skips rows locked by another, and
+    a batch whose rows were deleted by another run before it committed is rolled
+    back instead of archived twice. Must be called inside an application context.
+
+    Args:
+        older_than_days: Age in days after which records are archived
+        batch_size: Number of records moved per transaction
+        max_batches: Optional limit on the number of batches to process
+        pause: Seconds to sleep between batches to leave room for other queries
+        on_archived: Optional callable receiving the list of archived record ids
+
+    Returns:
+        Number of records archived
+    """
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        query = HeadacheRecord.query \
+            .filter(HeadacheRecord.created_at < cutoff) \
+            .order_by(HeadacheRecord.id) \
+            .limit(batch_size)
+        if db.engine.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        records = query.all()
+        if not records:
+            break
+
+        # One compressed payload per month in the batch
+        months = {}
+        for record in records:
+            months.setdefault(record.created_at.strftime("%Y-%m"), []).append(record)
+
+        try:
+            for month, month_records in months.items():
+                codec, payload = _compress(json.dumps([record.to_dict() for record in month_records]).encode("utf-8"))
+                db.session.add(HeadacheArchive(
+                    month=month,
+                    first_created_at=min(record.created_at for record in month_records),
+                    last_created_at=max(record.created_at for record in month_records),
+                    first_record_id=min(record.id for record in month_records),
+                    last_record_id=max(record.id for record in month_records),
+                    record_count=len(month_records),
+                    codec=codec,
+                    payload=payload
+                ))
+
+            record_ids = [record.id for record in records]
+            deleted = HeadacheRecord.query.filter(HeadacheRecord.id.in_(record_ids)).delete(synchronize_session=False)
+            if deleted != len(records):
+                # Another run archived some of these rows first, select the batch again
+                db.session.rollback()
+                logger.warning(f"Archive batch up to id {record_ids[-1]} was taken by another run, retrying")
+                continue
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        archived += len(records)
+        batches += 1
+        logger.info(f"Archived {len(records)} records (up to id {record_ids[-1]}), {archived} in total")
+
+        if on_archived:
+            on_archived(record_ids)
+        if pause:
+            time.sleep(pause)
+
+    return archived
+
+
+def load_archived_records(start=None, end=None):
+    """
+    Load archived records created within a time range
+
+    Only archive batches overlapping the range are decompressed.
+
+    Args:
+        start: Optional inclusive lower bound on created_at (naive UTC)
+        end: Optional exclusive upper bound on created_at (naive UTC)
+
+    Returns:
+        List of record dictionaries marked as archived, most recent first
+    """
+    query = HeadacheArchive.query
+    if start is not None:
+        query = query.filter(HeadacheArchive.last_created_at >= start)
+    if end is not None:
+        query = query.filter(HeadacheArchive.first_created_at < end)
+
+    records = []
+    for batch in query.order_by(HeadacheArchive.first_created_at).all():
+        for record in json.loads(_decompress(batch.codec, batch.payload)):
+            created_at = datetime.fromisoformat(record["created_at"])
+            if start is not None and created_at < start:
+                continue
+            if end is not None and created_at >= end:
+                continue
+            record["archived"] = True
+            records.append(record)
+
+    records.sort(key=lambda record: record["created_at"], reverse=True)
+    return records
@@ -0,0 +1,239 @@
+import os
+import re
+import zlib
+import logging
+import threading
+import numpy as np
+from models import db, HeadacheRecord
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "the", "i", "my", "me", "is", "it", "of", "in", "on", "to",
+    "have", "has", "had", "with", "at", "for", "am", "be", "been", "this", "that"
+}
+
+
+class EpisodeIndex:
+    """
+    In-memory vector index over the symptoms of past headache records
+
+    Symptoms are embedded locally with a hashed bag of words and bigrams, so every
+    record can be indexed on insert without a network call, and the whole index
+    can be rebuilt from the table at any time.
+
+    Each worker process keeps its own copy. It tracks the highest record id read
+    from the table and catches up from there before searching, so records
+    inserted by other workers are found too; records deleted elsewhere (e.g.
+    archived) are dropped when a search finds their rows missing.
+    """
+
+    def __init__(self, dimensions=None, batch_size=None):
+        """
+        Initialize an empty index
+
+        Args:
+            dimensions: Size of the hashed embedding vectors
+            batch_size: Number of rows loaded per query when rebuilding
+        """
+        self.dimensions = dimensions or int(os.environ.get("EPISODE_INDEX_DIMENSIONS", "256"))
+        self.batch_size = batch_size or int(os.environ.get("EPISODE_INDEX_BATCH_SIZE", "1000"))
+
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._vectors = np.zeros((1024, self.dimensions), dtype=np.float32)
+        self._ids = np.full(1024, -1, dtype=np.int64)
+        self._size = 0
+        self._positions = {}
+        self._last_id = 0
+        self._holes = 0
+        self._built = False
+
+    def embed(self, text):
+        """
+        Embed text as a normalized hashed bag of words and bigrams
+
+        Args:
+            text: Symptoms text
+
+        Returns:
+            Unit-length float32 vector (all zeros if the text has no usable words)
+        """
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = [word for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+        for feature in features:
+            digest = zlib.crc32(feature.encode("utf-8"))
+            # The top bit picks a sign so that collisions tend to cancel out
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimensions] += sign
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def _append(self, record_id, vector):
+        """Append a vector, growing the storage if needed (caller holds the lock)"""
+        if record_id in self._positions:
+            return
+
+        if self._size == len(self._ids):
+            capacity = len(self._ids) * 2
+            vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            ids = np.full(capacity, -1, dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._vectors, self._ids = vectors, ids
+
+        self._vectors[self._size] = vector
+        self._ids[self._size] = record_id
+        self._positions[record_id] = self._size
+        self._size += 1
+
+    def _compact(self):
+        """Drop the rows left empty by remove() (caller holds the lock)"""
+        keep = self._ids[:self._size] >= 0
+        size = int(keep.sum())
+        capacity = max(1024, len(self._ids))
+        vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        vectors[:size] = self._vectors[:self._size][keep]
+        ids = np.full(capacity, -1, dtype=np.int64)
+        ids[:size] = self._ids[:self._size][keep]
+
+        self._vectors, self._ids, self._size = vectors, ids, size
+        self._positions = {int(record_id): position for position, record_id in enumerate(ids[:size])}
+        self._holes = 0
+
+    @property
+    def built(self):
+        """Whether the initial build from the table has finished"""
+        return self._built
+
+    def add(self, record_id, symptoms):
+        """
+        Add a newly stored record to the index
+
+        Does not move the catch-up cursor: records with lower ids inserted by
+        other workers may not have been loaded yet.
+
+        Args:
+            record_id: HeadacheRecord id
+            symptoms: The record's symptoms text
+        """
+        vector = self.embed(symptoms)
+        with self._lock:
+            self._append(record_id, vector)
+
+    def remove(self, record_ids):
+        """
+        Remove records from the index (e.g. after they are archived or deleted)
+
+        Args:
+            record_ids: Iterable of HeadacheRecord ids
+        """
+        with self._lock:
+            for record_id in record_ids:
+                position = self._positions.pop(record_id, None)
+                if position is not None:
+                    self._vectors[position] = 0
+                    self._ids[position] = -1
+                    self._holes += 1
+
+            # Compact once a quarter of the rows are empty
+            if self._holes and self._holes * 4 >= self._size:
+                self._compact()
+
+    def _load_batch(self, after_id):
+        """Load the next batch of (id, symptoms) rows after the given id"""
+        return db.session.query(HeadacheRecord.id, HeadacheRecord.symptoms) \
+            .filter(HeadacheRecord.id > after_id) \
+            .order_by(HeadacheRecord.id) \
+            .limit(self.batch_size).all()
+
+    def rebuild(self):
+        """
+        Rebuild the index from the headache_record table
+
+        Rows are streamed in id order in batches of batch_size so that memory use
+        and query time stay bounded regardless of the table size. Slow for large
+        tables, so run it at startup or in a background thread, never while
+        serving a request. Must be called inside an application context.
+        """
+        with self._build_lock:
+            fresh = EpisodeIndex(self.dimensions, self.batch_size)
+            while True:
+                rows = self._load_batch(fresh._last_id)
+                if not rows:
+                    break
+                for record_id, symptoms in rows:
+                    fresh._append(record_id, fresh.embed(symptoms))
+                fresh._last_id = rows[-1][0]
+
+            with self._lock:
+                self._vectors, self._ids = fresh._vectors, fresh._ids
+                self._size, self._positions = fresh._size, fresh._positions
+                self._last_id = fresh._last_id
+                self._holes = 0
+                self._built = True
+
+        # Pick up anything inserted while the table was being scanned
+        self.catch_up()
+        logger.info(f"Rebuilt episode index with {len(self._positions)} records")
+
+    def catch_up(self):
+        """
+        Index records inserted since the highest indexed id (e.g. by other workers)
+
+        Loads at most one batch per call so the cost on the request path stays
+        bounded; any remainder is picked up by the next call. Must be called inside
+        an application context.
+        """
+        rows = self._load_batch(self._last_id)
+        if not rows:
+            return
+
+        vectors = [(record_id, self.embed(symptoms)) for record_id, symptoms in rows]
+        with self._lock:
+            for record_id, vector in vectors:
+                self._append(record_id, vector)
+            # Concurrent calls may load the same batch, never move the cursor back
+            self._last_id = max(self._last_id, rows[-1][0])
+
+    def search(self, symptoms, top_k=5, exclude_id=None):
+        """
+        Find the past records with the most similar symptoms
+
+        Args:
+            symptoms: Symptoms text to compare against
+            top_k: Number of results to return
+            exclude_id: Optional record id to leave out (e.g. the query record itself)
+
+        Returns:
+            List of (record_id, similarity) tuples, most similar first
+        """
+        query = self.embed(symptoms)
+        if not query.any():
+            return []
+
+        with self._lock:
+            vectors = self._vectors[:self._size]
+            ids = self._ids[:self._size]
+            scores = vectors @ query
+
+        # Take one extra candidate in case the excluded record is among the best
+        candidates = min(top_k + 1, len(scores))
+        if candidates == 0:
+            return []
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            record_id = int(ids[position])
+            if record_id < 0 or record_id == exclude_id or scores[position] <= 0:
+                continue
+            results.append((record_id, float(scores[position])))
+        return results[:top_k]
@@ -1,12 +1,16 @@
 import os
+import time
 import logging
 import json
-from openai import OpenAI
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import OpenAI, APITimeoutError
 import numpy as np
 from knowledge_base import MedicalKnowledgeBase
+from profiling import worker_of
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured by the application (see LOG_LEVEL in app.py)
 logger = logging.getLogger(__name__)
 
 class HeadacheRAG:
@@ -15,17 +19,38 @@ class HeadacheRAG:
     Uses OpenAI API for LLM capabilities and a medical knowledge base for RAG
     """
     
-    def __init__(self, knowledge_base):
+    def __init__(self, knowledge_base, episode_lookup=None):
         """
         Initialize the HeadacheRAG system
         
         Args:
             knowledge_base: A MedicalKnowledgeBase instance
+            episode_lookup: Optional callable returning the user's most similar past
+                episodes for a symptoms string, added to the LLM context
         """
         self.knowledge_base = knowledge_base
+        self.episode_lookup = episode_lookup
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
         self.openai_client = OpenAI(api_key=self.openai_api_key) if self.openai_api_key else None
         
+        # Tiered inference settings - the rule scorer answers on its own when the
+        # winning headache type leads the runner-up by at least this margin
+        self.confidence_threshold = float(os.environ.get("TIER_CONFIDENCE_THRESHOLD", "0.5"))
+        self.min_rule_matches = int(os.environ.get("TIER_MIN_RULE_MATCHES", "3"))
+        
+        # Latency settings - every escalated request answers within the deadline,
+        # using the rule-based answer if the LLM pipeline has not finished by then
+        self.deadline_seconds = float(os.environ.get("ANALYZE_DEADLINE_SECONDS", "10"))
+        self.embed_timeout = float(os.environ.get("EMBED_TIMEOUT_SECONDS", "2"))
+        self.hedge_percentile = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+        self.default_hedge_delay = float(os.environ.get("HEDGE_DELAY_SECONDS", "4"))
+        self._generate_latencies = deque(maxlen=200)
+        self._latency_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("ANALYZE_WORKERS", "16")),
+            thread_name_prefix="headache-rag"
+        )
+        
         # Define system prompt
         self.system_prompt = """
         You are a headache diagnosis assistant. Your task is to analyze the user's symptoms 
@@ -43,19 +68,53 @@ class HeadacheRAG:
         Use the provided context information to formulate your response.
         """
     
-    def _embed_text(self, text):
+    def _submit(self, fn, *args):
+        """
+        Run a pipeline stage on the executor, attributed to the calling request's profile
+        
+        Args:
+            fn: Callable to run
+            *args: Arguments for the callable
+            
+        Returns:
+            Future for the result
+        """
+        parent_thread_id = threading.get_ident()
+        
+        def run():
+            with worker_of(parent_thread_id):
+                return fn(*args)
+        
+        return self._executor.submit(run)
+    
+    def _client(self, timeout=None):
+        """
+        Get the OpenAI client, bounded by a timeout when one is given
+        
+        Args:
+            timeout: Optional seconds allowed for the call (disables SDK retries)
+            
+        Returns:
+            OpenAI client
+        """
+        if timeout is None:
+            return self.openai_client
+        return self.openai_client.with_options(timeout=max(timeout, 0.1), max_retries=0)
+    
+    def _embed_text(self, text, timeout=None):
         """
         Embed the text using OpenAI's API (fallback to simple keyword matching if unavailable)
         
         Args:
             text: Text to embed
+            timeout: Optional seconds allowed for the API call
             
         Returns:
             Embedding vector or keywords
         """
         try:
             if self.openai_client:
-                response = self.openai_client.embeddings.create(
+                response = self._client(timeout).embeddings.create(
                     model="text-embedding-ada-002",
                     input=text
                 )
@@ -88,13 +147,43 @@ class HeadacheRAG:
             
         return "\n\n".join(results)
     
-    def _generate_response(self, symptoms, context):
+    def _retrieve_past_episodes(self, symptoms, top_k=3):
+        """
+        Retrieve the user's most similar past episodes as context
+        
+        Args:
+            symptoms: User's symptoms
+            top_k: Number of past episodes to include
+            
+        Returns:
+            Past episodes formatted as a string (empty if none are available)
+        """
+        if not self.episode_lookup:
+            return ""
+        
+        try:
+            episodes = self.episode_lookup(symptoms, top_k)
+        except Exception as e:
+            logger.error(f"Error retrieving past episodes: {str(e)}")
+            return ""
+        
+        if not episodes:
+            return ""
+        
+        lines = ["Similar past episodes from this user's history:"]
+        for episode in episodes:
+            lines.append(f"- {episode['created_at']}: symptoms \"{episode['symptoms']}\", "
+                         f"diagnosis \"{episode['diagnosis']}\"")
+        return "\n".join(lines)
+    
+    def _generate_response(self, symptoms, context, timeout=None):
         """
         Generate a response using OpenAI's API
         
         Args:
             symptoms: User's symptoms
             context: Retrieved medical knowledge context
+            timeout: Optional seconds allowed for the API call
             
         Returns:
             Generated diagnosis and recommendations
@@ -102,19 +191,28 @@ class HeadacheRAG:
         try:
             if not self.openai_client:
                 raise ValueError("OpenAI API key not available")
-                
+            
+            start = time.monotonic()
+            
             # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
             # do not change this unless explicitly requested by the user
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": f"Symptoms: {symptoms}\n\nContext: {context}"}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.5,
-                max_tokens=1000
-            )
+            try:
+                response = self._client(timeout).chat.completions.create(
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": f"Symptoms: {symptoms}\n\nContext: {context}"}
+                    ],
+                    response_format={"type": "json_object"},
+                    temperature=0.5,
+                    max_tokens=1000
+                )
+            except APITimeoutError:
+                # Timed-out calls count too (with the time they were allowed), otherwise
+                # slow periods would leave the hedge percentile biased low
+                self._record_latency(time.monotonic() - start)
+                raise
+            self._record_latency(time.monotonic() - start)
             
             result = json.loads(response.choices[0].message.content)
             return result.get("diagnosis"), result.get("recommendations")
@@ -123,47 +221,155 @@ class HeadacheRAG:
             logger.error(f"Error generating response: {str(e)}")
             raise
     
+    def _record_latency(self, seconds):
+        """Record how long an LLM call took, for the hedge delay percentile"""
+        with self._latency_lock:
+            self._generate_latencies.append(seconds)
+    
+    def _hedge_delay(self):
+        """
+        Get how long to wait for an LLM call before sending a duplicate request
+        
+        Returns:
+            The configured percentile of recent call latencies, or the default
+            delay until enough calls have been observed
+        """
+        with self._latency_lock:
+            latencies = sorted(self._generate_latencies)
+        
+        if len(latencies) < 20:
+            return self.default_hedge_delay
+        index = min(int(len(latencies) * self.hedge_percentile / 100), len(latencies) - 1)
+        return latencies[index]
+    
+    def _generate_with_hedging(self, symptoms, context, deadline):
+        """
+        Generate a response, sending a duplicate request if the first one is slow
+        
+        Args:
+            symptoms: User's symptoms
+            context: Retrieved medical knowledge context
+            deadline: time.monotonic() value by which an answer is needed
+            
+        Returns:
+            Diagnosis and recommendations from whichever request succeeds first
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Deadline exceeded before generating a response")
+        
+        pending = {self._submit(self._generate_response, symptoms, context, remaining)}
+        hedged = False
+        error = None
+        
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            wait_for = remaining if hedged else min(self._hedge_delay(), remaining)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            
+            # Hedge once if the first request is still outstanding after the delay
+            if not done and not hedged:
+                hedged = True
+                remaining = deadline - time.monotonic()
+                logger.info(f"Hedging slow LLM request with {remaining:.1f}s left before the deadline")
+                pending.add(self._submit(self._generate_response, symptoms, context, remaining))
+        
+        for future in pending:
+            future.cancel()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError("Deadline exceeded while generating a response")
+    
     def analyze_headache(self, symptoms):
         """
-        Analyze headache symptoms using RAG
+        Analyze headache symptoms using tiered inference
+        
+        The cheap rule scorer runs first. Emergency red flags and clear-cut cases
+        are answered immediately; only ambiguous inputs escalate to retrieval + LLM.
+        Escalated requests run lexical retrieval while the embedding call is in
+        flight and are bounded by a deadline, after which the rule-based answer
+        (computed up front) is returned.
         
         Args:
             symptoms: User's description of headache symptoms
             
         Returns:
-            Diagnosis and recommendations
+            Tuple of (diagnosis, recommendations, tier) where tier is one of
+            "emergency", "rules", "llm" or "fallback"
         """
+        deadline = time.monotonic() + self.deadline_seconds
+        scores = self.score_symptoms(symptoms)
+        
+        # The rule-based answer is cheap, so it is always ready before any network call
+        fallback_diagnosis, fallback_recommendations = self.fallback_analysis(symptoms, scores)
+        
+        if scores["is_emergency"]:
+            return fallback_diagnosis, fallback_recommendations, "emergency"
+        
+        if scores["confidence"] >= self.confidence_threshold and scores["top_count"] >= self.min_rule_matches:
+            return fallback_diagnosis, fallback_recommendations, "rules"
+        
         try:
-            # Embed the symptoms
-            query_embedding = self._embed_text(symptoms)
+            # Embed the symptoms and run keyword retrieval at the same time
+            embed_start = time.monotonic()
+            embed_timeout = min(self.embed_timeout, deadline - embed_start)
+            embedding_future = self._submit(self._embed_text, symptoms, embed_timeout)
+            lexical_future = self._submit(self._retrieve_relevant_context, symptoms.lower().split())
+            
+            # Past episodes come from the local index (and need the request's app context).
+            # The lookup returns nothing until the index is built, and otherwise costs at
+            # most one catch-up batch plus an in-memory search
+            past_episodes = self._retrieve_past_episodes(symptoms) if time.monotonic() < deadline else ""
+            
+            # Use vector retrieval if the embedding arrives in time, keyword results otherwise
+            done, _ = wait([embedding_future], timeout=max(embed_start + embed_timeout - time.monotonic(), 0))
+            if not done:
+                # Don't let a still-queued embedding run later with its stale timeout
+                embedding_future.cancel()
+            query_embedding = embedding_future.result() if done else None
+            if isinstance(query_embedding, list) and query_embedding and all(isinstance(x, float) for x in query_embedding):
+                context = self._retrieve_relevant_context(query_embedding)
+            else:
+                if not done:
+                    logger.warning("Embedding exceeded its time budget, using keyword retrieval")
+                context = lexical_future.result(timeout=max(deadline - time.monotonic(), 0))
             
-            # Retrieve relevant context
-            context = self._retrieve_relevant_context(query_embedding)
+            if past_episodes:
+                context = f"{context}\n\n{past_episodes}"
             
             # Generate response
-            diagnosis, recommendations = self._generate_response(symptoms, context)
+            diagnosis, recommendations = self._generate_with_hedging(symptoms, context, deadline)
             
-            return diagnosis, recommendations
+            return diagnosis, recommendations, "llm"
             
         except Exception as e:
             logger.error(f"Error in analyze_headache: {str(e)}")
             # Use fallback method and include the error
-            return self.fallback_analysis(symptoms)
+            return fallback_diagnosis, fallback_recommendations, "fallback"
     
-    def fallback_analysis(self, symptoms):
+    def score_symptoms(self, symptoms):
         """
-        Fallback method for when the API fails
+        Score symptoms against the keyword lists for each headache type
         
         Args:
             symptoms: User's description of headache symptoms
             
         Returns:
-            Tuple of (diagnosis, recommendations)
+            Dictionary with per-type counts, the emergency flag and a 0-1 confidence
+            (how far the top headache type leads the runner-up)
         """
         # Simple keyword-based analysis with improved pattern matching
         keywords = symptoms.lower()
-        diagnosis = "Based on the pattern matching analysis of your symptoms, "
-        recommendations = ["Please consult a healthcare professional for proper diagnosis."]
         
         # Break all words into single words and check for individual term matches
         # This improves detection when users don't use exact phrases
@@ -199,8 +405,43 @@ class HeadacheRAG:
         if "light sensitive" in keywords or "sensitivity to light" in keywords or "worse with light" in keywords:
             migraine_count += 2  # Another strong migraine indicator
         
+        is_emergency = emergency_count >= 2 and any(word in keywords_list for word in ["worst", "sudden", "severe"])
+        
+        # Confidence is the margin between the top two headache types
+        counts = sorted([migraine_count, tension_count, cluster_count, sinus_count], reverse=True)
+        top_count, runner_up_count = counts[0], counts[1]
+        confidence = (top_count - runner_up_count) / top_count if top_count else 0.0
+        
+        return {
+            "migraine": migraine_count,
+            "tension": tension_count,
+            "cluster": cluster_count,
+            "sinus": sinus_count,
+            "emergency": emergency_count,
+            "is_emergency": is_emergency,
+            "top_count": top_count,
+            "confidence": confidence
+        }
+    
+    def fallback_analysis(self, symptoms, scores=None):
+        """
+        Fallback method for when the API fails
+        
+        Args:
+            symptoms: User's description of headache symptoms
+            scores: Optional result of score_symptoms, computed if not provided
+            
+        Returns:
+            Tuple of (diagnosis, recommendations)
+        """
+        if scores is None:
+            scores = self.score_symptoms(symptoms)
+        
+        diagnosis = "Based on the pattern matching analysis of your symptoms, "
+        recommendations = ["Please consult a healthcare professional for proper diagnosis."]
+        
         # Check for possible emergency conditions first
-        if emergency_count >= 2 and any(word in keywords_list for word in ["worst", "sudden", "severe"]):
+        if scores["is_emergency"]:
             diagnosis = "Your symptoms suggest a potentially serious condition that requires IMMEDIATE medical attention."
             recommendations = [
                 "⚠️ SEEK EMERGENCY CARE IMMEDIATELY",
@@ -212,28 +453,28 @@ class HeadacheRAG:
         
         # Determine most likely headache type based on keyword count
         headache_types = [
-            (migraine_count, "migraine", [
+            (scores["migraine"], "migraine", [
                 "Rest in a quiet, dark room",
                 "Apply cold or warm compress to the forehead or neck",
                 "Stay well hydrated",
                 "Over-the-counter pain medications such as ibuprofen may help (follow package instructions)",
                 "Track potential triggers like certain foods, stress, or hormonal changes"
             ]),
-            (tension_count, "tension headache", [
+            (scores["tension"], "tension headache", [
                 "Practice stress management techniques like deep breathing or meditation",
                 "Take regular breaks from screen time and work",
                 "Apply gentle stretching to neck and shoulder muscles",
                 "Consider over-the-counter pain relievers if appropriate",
                 "Maintain good posture, especially when working at a desk"
             ]),
-            (cluster_count, "cluster headache", [
+            (scores["cluster"], "cluster headache", [
                 "Consult a doctor promptly as cluster headaches often require prescription medication",
                 "Oxygen therapy might help (requires medical supervision)",
                 "Avoid alcohol consumption during headache periods",
                 "Keep a regular sleep schedule",
                 "Avoid smoking and tobacco products"
             ]),
-            (sinus_count, "sinus headache", [
+            (scores["sinus"], "sinus headache", [
                 "Use a saline nasal spray to clear congestion",
                 "Apply warm compresses to painful sinus areas",
                 "Stay hydrated to thin mucus secretions",
@@ -0,0 +1,198 @@
+import os
+import gzip
+import zlib
+import hashlib
+import logging
+from datetime import timezone
+from flask import request
+
+# Brotli is optional - gzip is used when it is not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Responses smaller than this are not worth the CPU cost of compressing
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain"
+}
+
+# Fingerprinted static URLs never change content, so they can be cached for a year
+STATIC_MAX_AGE = 31536000
+
+_fingerprints = {}
+
+
+def _static_fingerprint(static_folder, filename):
+    """
+    Get a short content hash for a static file, cached until the file changes
+
+    Args:
+        static_folder: Absolute path of the app's static folder
+        filename: Path of the file relative to the static folder
+
+    Returns:
+        Hex digest prefix, or None if the file cannot be read
+    """
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+    _fingerprints[path] = (mtime, digest)
+    return digest
+
+
+def history_validators(last_id, record_count, last_created_at, last_archived_at=None, scope=None):
+    """
+    Build cache validators for the history payload
+
+    Records are never edited; they are only inserted or removed by archiving.
+    Inserts raise the latest id, archiving lowers the row count, so the two
+    together identify the hot history without reading any row data. Archiving
+    also moves Last-Modified forward, since it removes old rows without
+    changing the latest created_at.
+
+    Args:
+        last_id: Highest HeadacheRecord id (None if the table is empty)
+        record_count: Number of HeadacheRecord rows
+        last_created_at: Most recent created_at timestamp (naive UTC)
+        last_archived_at: Most recent HeadacheArchive.archived_at (naive UTC), if any
+        scope: Optional string identifying the filters and archive state of the request
+
+    Returns:
+        Tuple of (etag, last_modified)
+    """
+    etag = f"history-{last_id or 0}-{record_count}"
+    if scope:
+        etag += f"-{zlib.crc32(scope.encode('utf-8')):08x}"
+
+    last_modified = None
+    changed_at = [value for value in (last_created_at, last_archived_at) if value is not None]
+    if changed_at:
+        last_modified = max(changed_at).replace(microsecond=0, tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    """
+    Check the current request's conditional headers against the validators
+
+    Args:
+        etag: Weak entity tag for the resource
+        last_modified: Timezone-aware last modification time, or None
+
+    Returns:
+        True if the client's cached copy is still current
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    """Attach validators and a revalidate-every-time cache policy to a response"""
+    # Weak so that the same tag stays valid for gzip and brotli encodings
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
+def _compress_response(response):
+    """
+    Compress the response body in place if the client supports it
+
+    Args:
+        response: Flask response object
+
+    Returns:
+        The (possibly compressed) response
+    """
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    if brotli is not None and request.accept_encodings["br"]:
+        encoding = "br"
+    elif request.accept_encodings["gzip"]:
+        encoding = "gzip"
+    else:
+        return response
+
+    # Static files are streamed from disk by default, read them so they can be compressed
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    else:
+        compressed = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    # A strong ETag promises identical bytes, which no longer holds. Weaken it
+    # rather than changing the tag: send_file has already compared the request
+    # against the plain tag, and If-None-Match uses weak comparison, so
+    # revalidating with it still gets a 304.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_http_cache(app):
+    """
+    Register static fingerprinting, long-lived static caching and response compression
+
+    Args:
+        app: Flask application
+    """
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        # url_for('static', filename=...) becomes /static/<file>?v=<content hash>
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            fingerprint = _static_fingerprint(app.static_folder, values["filename"])
+            if fingerprint:
+                values["v"] = fingerprint
+
+    @app.after_request
+    def apply_http_cache(response):
+        if request.endpoint == "static" and request.args.get("v"):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+
+        try:
+            return _compress_response(response)
+        except Exception as e:
+            logger.error(f"Error compressing response: {str(e)}")
+            return response
@@ -2,8 +2,7 @@ import numpy as np
 import logging
 from medical_knowledge.headache_data import HEADACHE_KNOWLEDGE
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured by the application (see LOG_LEVEL in app.py)
 logger = logging.getLogger(__name__)
 
 class MedicalKnowledgeBase:
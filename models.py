@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 
@@ -15,8 +16,52 @@ class HeadacheRecord(db.Model):
     recommendations = db.Column(db.Text, nullable=False)  # Stored as JSON string
     
     # Metadata
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     used_fallback = db.Column(db.Boolean, default=False)
     
+    # Which inference tier produced the answer: emergency, rules, llm or fallback
+    tier = db.Column(db.String(20), nullable=True)
+    
+    def to_dict(self):
+        """Format the record for JSON responses and archive payloads"""
+        # Handle potential JSON parsing errors
+        try:
+            recommendations = json.loads(self.recommendations)
+        except:
+            recommendations = ["Error loading recommendations"]
+        
+        return {
+            "id": self.id,
+            "symptoms": self.symptoms,
+            "diagnosis": self.diagnosis,
+            "recommendations": recommendations,
+            "created_at": self.created_at.isoformat(),
+            "used_fallback": self.used_fallback,
+            "tier": self.tier
+        }
+    
+    def __repr__(self):
+        return f"<HeadacheRecord id={self.id} created_at={self.created_at}>"
+
+class HeadacheArchive(db.Model):
+    """Compressed batch of old headache records for one month, moved out of the hot table"""
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Month the records were created in, as YYYY-MM
+    month = db.Column(db.String(7), nullable=False, index=True)
+    
+    # Range covered by this batch, used to find batches without decompressing them
+    first_created_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_created_at = db.Column(db.DateTime, nullable=False, index=True)
+    first_record_id = db.Column(db.Integer, nullable=False)
+    last_record_id = db.Column(db.Integer, nullable=False)
+    record_count = db.Column(db.Integer, nullable=False)
+    
+    # Compressed JSON list of HeadacheRecord.to_dict() payloads
+    codec = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
     def __repr__(self):
-        return f"<HeadacheRecord id={self.id} created_at={self.created_at}>"
\ No newline at end of file
+        return f"<HeadacheArchive id={self.id} month={self.month} records={self.record_count}>"
@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# Worker thread id -> id of the request thread it is doing work for
+_worker_parents = {}
+
+
+@contextmanager
+def worker_of(parent_thread_id):
+    """
+    Attribute work done on the current thread to a request thread's profile
+
+    Wrap tasks that a request hands off to a thread pool, so that slow work on
+    worker threads shows up in the request's profile instead of only the wait.
+
+    Args:
+        parent_thread_id: threading.get_ident() of the request thread
+    """
+    thread_id = threading.get_ident()
+    _worker_parents[thread_id] = parent_thread_id
+    try:
+        yield
+    finally:
+        _worker_parents.pop(thread_id, None)
+
+
+class RequestProfiler:
+    """
+    Opt-in stack sampling profiler for Flask requests
+
+    A background thread periodically samples the stack of every thread that is
+    serving a request, and of worker threads running tasks for it (see
+    worker_of). When a request finishes, its samples are kept if it was picked
+    for sampling or ran longer than the slow-request threshold, and discarded
+    otherwise. Captured profiles are stored as collapsed stacks, the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, sample_rate=None, slow_request_ms=None, interval_ms=None, max_captures=None):
+        """
+        Initialize the profiler from arguments or environment variables
+
+        Args:
+            sample_rate: Fraction of requests (0-1) to always capture
+            slow_request_ms: Capture any request slower than this (0 disables)
+            interval_ms: Time between stack samples
+            max_captures: Number of captured profiles kept in memory
+        """
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+        self.slow_request_ms = slow_request_ms if slow_request_ms is not None else float(os.environ.get("SLOW_REQUEST_MS", "0"))
+        self.interval = (interval_ms if interval_ms is not None else float(os.environ.get("PROFILE_INTERVAL_MS", "10"))) / 1000
+        self.captures = deque(maxlen=max_captures or int(os.environ.get("PROFILE_MAX_CAPTURES", "50")))
+
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._next_id = 1
+
+    @property
+    def enabled(self):
+        """Whether any requests can be captured with the current settings"""
+        return self.sample_rate > 0 or self.slow_request_ms > 0
+
+    def _ensure_sampler(self):
+        """Start the sampler thread on first use (after any worker fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _collapse(frame):
+        """Format a frame's stack from outermost to innermost call as file:function;..."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        """Sampler loop: record the current stack of every thread serving a request"""
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+
+            frames = sys._current_frames()
+            # Counters are only touched under the lock, so finished captures never change
+            with self._lock:
+                for thread_id, active in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        active["stacks"][self._collapse(frame)] += 1
+
+                for thread_id, parent_thread_id in list(_worker_parents.items()):
+                    active = self._active.get(parent_thread_id)
+                    frame = frames.get(thread_id)
+                    if active is not None and frame is not None:
+                        active["stacks"][f"[worker thread];{self._collapse(frame)}"] += 1
+
+    def start_request(self):
+        """Begin tracking the current request"""
+        self._ensure_sampler()
+        active = {
+            "method": request.method,
+            "path": request.path,
+            "started_at": datetime.utcnow(),
+            "start": time.perf_counter(),
+            "sampled": random.random() < self.sample_rate,
+            "status": None,
+            "stacks": Counter()
+        }
+        with self._lock:
+            self._active[threading.get_ident()] = active
+
+    def set_status(self, status_code):
+        """Record the response status of the current request"""
+        active = self._active.get(threading.get_ident())
+        if active is not None:
+            active["status"] = status_code
+
+    def finish_request(self):
+        """Stop tracking the current request and keep its profile if it qualifies"""
+        with self._lock:
+            active = self._active.pop(threading.get_ident(), None)
+        if active is None:
+            return
+
+        duration_ms = (time.perf_counter() - active["start"]) * 1000
+        is_slow = self.slow_request_ms > 0 and duration_ms >= self.slow_request_ms
+        if not (is_slow or active["sampled"]):
+            return
+
+        with self._lock:
+            capture_id = self._next_id
+            self._next_id += 1
+            self.captures.append({
+                "id": capture_id,
+                "method": active["method"],
+                "path": active["path"],
+                "status": active["status"],
+                "started_at": active["started_at"].isoformat(),
+                "duration_ms": round(duration_ms, 1),
+                "reason": "slow" if is_slow else "sampled",
+                "samples": sum(active["stacks"].values()),
+                "stacks": active["stacks"]
+            })
+
+        if is_slow:
+            logger.warning(f"Slow request {active['method']} {active['path']} took {duration_ms:.0f}ms "
+                           f"(profile {capture_id})")
+
+    def list_captures(self):
+        """Get metadata for all captured profiles, most recent first"""
+        with self._lock:
+            captures = list(self.captures)
+        return [{key: value for key, value in capture.items() if key != "stacks"}
+                for capture in reversed(captures)]
+
+    def folded(self, capture_id=None):
+        """
+        Get captured stacks in collapsed (folded) format
+
+        Args:
+            capture_id: Capture to export, or None to merge all captures
+
+        Returns:
+            Folded stack text ("frame;frame;frame count" per line), or None if
+            the capture does not exist
+        """
+        with self._lock:
+            captures = list(self.captures)
+
+        stacks = Counter()
+        found = False
+        for capture in captures:
+            if capture_id is None or capture["id"] == capture_id:
+                stacks.update(capture["stacks"])
+                found = True
+
+        if capture_id is not None and not found:
+            return None
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def init_profiling(app):
+    """
+    Register request profiling hooks if profiling is enabled
+
+    Args:
+        app: Flask application
+
+    Returns:
+        The RequestProfiler instance
+    """
+    profiler = RequestProfiler()
+    if not profiler.enabled:
+        return profiler
+
+    @app.before_request
+    def start_profiling():
+        profiler.start_request()
+
+    @app.after_request
+    def record_profiling_status(response):
+        profiler.set_status(response.status_code)
+        return response
+
+    @app.teardown_request
+    def finish_profiling(exc):
+        profiler.finish_request()
+
+    logger.info(f"Request profiling enabled (sample rate {profiler.sample_rate}, "
+                f"slow threshold {profiler.slow_request_ms}ms)")
+    return profiler
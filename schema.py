@@ -0,0 +1,71 @@
+import logging
+from sqlalchemy import inspect, text
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Columns added to headache_record after its first release, with their DDL types
+ADDED_COLUMNS = {
+    "tier": "VARCHAR(20)"
+}
+
+# Indexes added after the first release (names match what db.create_all() generates)
+ADDED_INDEXES = {
+    "ix_headache_record_created_at": "created_at"
+}
+
+
+def missing_schema_changes():
+    """
+    List the schema upgrades an existing database still needs (cheap enough to run at startup)
+
+    db.create_all() creates missing tables but never alters existing ones, so
+    databases created before these changes need upgrade_schema(). Must be
+    called inside an application context.
+
+    Returns:
+        List of missing column and index names
+    """
+    inspector = inspect(db.engine)
+    if not inspector.has_table("headache_record"):
+        return []
+
+    columns = {column["name"] for column in inspector.get_columns("headache_record")}
+    indexes = {index["name"] for index in inspector.get_indexes("headache_record")}
+    return [name for name in ADDED_COLUMNS if name not in columns] + \
+        [name for name in ADDED_INDEXES if name not in indexes]
+
+
+def upgrade_schema():
+    """
+    Bring an existing headache_record table up to date with the model
+
+    Idempotent: columns and indexes that already exist are skipped. On
+    PostgreSQL the index is built CONCURRENTLY so the table stays writable.
+    Must be called inside an application context.
+
+    Returns:
+        List of the column and index names that were added
+    """
+    missing = missing_schema_changes()
+    if not missing:
+        return []
+
+    dialect = db.engine.dialect.name
+    concurrently = "CONCURRENTLY " if dialect == "postgresql" else ""
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for name, column_type in ADDED_COLUMNS.items():
+            if name in missing:
+                connection.execute(text(f"ALTER TABLE headache_record ADD COLUMN {name} {column_type}"))
+                logger.info(f"Added column headache_record.{name}")
+
+        for name, column in ADDED_INDEXES.items():
+            if name in missing:
+                connection.execute(text(
+                    f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON headache_record ({column})"
+                ))
+                logger.info(f"Created index {name}")
+
+    return missing
@@ -0,0 +1,214 @@
+import html
+import logging
+from datetime import datetime
+from sqlalchemy import text
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Control characters mark highlighted terms, so user text can be escaped safely
+# before the markers are turned into <mark> tags
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+POSTGRES_SETUP = [
+    """
+    ALTER TABLE headache_record ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('english', coalesce(symptoms, '') || ' ' || coalesce(diagnosis, ''))
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_headache_record_search_vector ON headache_record USING GIN (search_vector)"
+]
+
+POSTGRES_SEARCH = """
+    WITH q AS (SELECT websearch_to_tsquery('english', :query) AS query),
+    hits AS (
+        SELECT r.id, r.symptoms, r.diagnosis, r.created_at, r.used_fallback, r.tier,
+               ts_rank_cd(r.search_vector, q.query) AS score
+        FROM headache_record r, q
+        WHERE r.search_vector @@ q.query
+        ORDER BY score DESC, r.id DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT hits.id, hits.created_at, hits.used_fallback, hits.tier, hits.score,
+           ts_headline('english', hits.symptoms, q.query, :options) AS symptoms_snippet,
+           ts_headline('english', hits.diagnosis, q.query, :options) AS diagnosis_snippet
+    FROM hits, q
+    ORDER BY hits.score DESC, hits.id DESC
+"""
+
+SQLITE_SETUP = [
+    """
+    CREATE VIRTUAL TABLE headache_record_fts USING fts5(
+        symptoms, diagnosis, content='headache_record', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER headache_record_fts_insert AFTER INSERT ON headache_record BEGIN
+        INSERT INTO headache_record_fts(rowid, symptoms, diagnosis) VALUES (new.id, new.symptoms, new.diagnosis);
+    END
+    """,
+    """
+    CREATE TRIGGER headache_record_fts_delete AFTER DELETE ON headache_record BEGIN
+        INSERT INTO headache_record_fts(headache_record_fts, rowid, symptoms, diagnosis)
+        VALUES ('delete', old.id, old.symptoms, old.diagnosis);
+    END
+    """,
+    """
+    CREATE TRIGGER headache_record_fts_update AFTER UPDATE ON headache_record BEGIN
+        INSERT INTO headache_record_fts(headache_record_fts, rowid, symptoms, diagnosis)
+        VALUES ('delete', old.id, old.symptoms, old.diagnosis);
+        INSERT INTO headache_record_fts(rowid, symptoms, diagnosis) VALUES (new.id, new.symptoms, new.diagnosis);
+    END
+    """,
+    # Index any rows that existed before the full-text table was created
+    "INSERT INTO headache_record_fts(headache_record_fts) VALUES ('rebuild')"
+]
+
+SQLITE_SEARCH = """
+    SELECT r.id, r.created_at, r.used_fallback, r.tier,
+           -bm25(headache_record_fts) AS score,
+           snippet(headache_record_fts, 0, char(2), char(3), '...', 16) AS symptoms_snippet,
+           snippet(headache_record_fts, 1, char(2), char(3), '...', 16) AS diagnosis_snippet
+    FROM headache_record_fts
+    JOIN headache_record r ON r.id = headache_record_fts.rowid
+    WHERE headache_record_fts MATCH :query
+    ORDER BY bm25(headache_record_fts), r.id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+
+SUPPORTED_DIALECTS = ("postgresql", "sqlite")
+
+_index_exists = False
+
+
+class SearchIndexMissing(Exception):
+    """Raised when searching before the full-text index has been created"""
+
+
+def search_index_exists():
+    """
+    Check whether the full-text index has been created (cheap enough to run at startup)
+
+    Must be called inside an application context.
+
+    Returns:
+        True if the index exists, False otherwise or on unsupported databases
+    """
+    global _index_exists
+    if _index_exists:
+        return True
+
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        exists = db.session.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'headache_record' AND column_name = 'search_vector'"
+        )).first()
+    elif dialect == "sqlite":
+        exists = db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'headache_record_fts'"
+        )).first()
+    else:
+        return False
+
+    _index_exists = exists is not None
+    return _index_exists
+
+
+def init_search_index():
+    """
+    Create the full-text index for headache records if it does not exist yet
+
+    PostgreSQL uses a generated tsvector column with a GIN index, SQLite an FTS5
+    table kept in sync by triggers. Both are updated on insert by the database
+    itself. On PostgreSQL, adding the column rewrites headache_record under an
+    exclusive lock, so this runs from the init-search-index CLI command during
+    maintenance, never at application startup. Must be called inside an
+    application context after the tables exist.
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+    if search_index_exists():
+        return
+
+    statements = POSTGRES_SETUP if dialect == "postgresql" else SQLITE_SETUP
+
+    try:
+        for statement in statements:
+            db.session.execute(text(statement))
+        db.session.commit()
+        logger.info("Full-text search index is ready")
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _sqlite_match_query(query):
+    """Quote each term so user input cannot break FTS5 query syntax"""
+    terms = query.split()
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _highlight(snippet):
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>")
+
+
+def search_records(query, page=1, per_page=20):
+    """
+    Search headache records by symptoms and diagnosis
+
+    Args:
+        query: Search terms entered by the user
+        page: 1-based page number
+        per_page: Number of results per page
+
+    Returns:
+        Tuple of (results, has_more) where results are ranked dictionaries with
+        HTML-escaped snippets in which matching terms are wrapped in <mark>
+
+    Raises:
+        NotImplementedError: The database is neither PostgreSQL nor SQLite
+        SearchIndexMissing: init_search_index has not been run yet
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+    if not search_index_exists():
+        raise SearchIndexMissing("Full-text search index has not been created")
+
+    # Fetch one extra row to know whether there is a next page without counting every match
+    params = {"limit": per_page + 1, "offset": (page - 1) * per_page}
+
+    if dialect == "postgresql":
+        params["query"] = query
+        params["options"] = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20"
+        rows = db.session.execute(text(POSTGRES_SEARCH), params).mappings().all()
+    else:
+        params["query"] = _sqlite_match_query(query)
+        if not params["query"]:
+            return [], False
+        rows = db.session.execute(text(SQLITE_SEARCH), params).mappings().all()
+
+    results = []
+    for row in rows[:per_page]:
+        created_at = row["created_at"]
+        # SQLite returns raw timestamps as strings from textual queries
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        results.append({
+            "id": row["id"],
+            "created_at": created_at.isoformat(),
+            "used_fallback": bool(row["used_fallback"]),
+            "tier": row["tier"],
+            "score": round(float(row["score"]), 6),
+            "symptoms_snippet": _highlight(row["symptoms_snippet"]),
+            "diagnosis_snippet": _highlight(row["diagnosis_snippet"])
+        })
+
+    return results, len(rows) > per_page
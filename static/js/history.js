@@ -31,7 +31,8 @@ document.addEventListener('DOMContentLoaded', function() {
         // Reset view state
         showHistoryLoading();
         
-        fetch('/api/history')
+        // Always revalidate so an unchanged history comes back as a cheap 304
+        fetch('/api/history', { cache: 'no-cache' })
             .then(response => {
                 if (!response.ok) {
                     throw new Error(`HTTP error! Status: ${response.status}`);
@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads DATABASE_URL at import time, so point it at a throwaway SQLite file first
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop("OPENAI_API_KEY", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from models import db, HeadacheRecord, HeadacheArchive  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The Flask app with empty headache_record and headache_archive tables"""
+    with flask_app.app_context():
+        HeadacheRecord.query.delete()
+        HeadacheArchive.query.delete()
+        db.session.commit()
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,66 @@
+import json
+import threading
+from datetime import datetime
+
+import archive
+from archive import archive_old_records, load_archived_records
+from models import db, HeadacheRecord, HeadacheArchive
+
+
+def _add_records(app, dates):
+    with app.app_context():
+        for created_at in dates:
+            db.session.add(HeadacheRecord(symptoms=f"pressure behind the eyes on {created_at:%Y-%m-%d}",
+                                          diagnosis="tension headache", recommendations=json.dumps([]),
+                                          tier="rules", created_at=created_at))
+        db.session.commit()
+
+
+def test_archive_and_restore_records(app):
+    old = [datetime(2024, 1, 5), datetime(2024, 1, 20), datetime(2024, 2, 3)]
+    _add_records(app, old + [datetime.utcnow()])
+
+    with app.app_context():
+        assert archive_old_records(older_than_days=90, batch_size=2) == 3
+
+        assert HeadacheRecord.query.count() == 1
+        batches = HeadacheArchive.query.order_by(HeadacheArchive.id).all()
+        # The first batch holds the two January records, the second the February one
+        assert [(batch.month, batch.record_count) for batch in batches] == [("2024-01", 2), ("2024-02", 1)]
+        assert all(batch.codec in ("zstd", "gzip") for batch in batches)
+
+        restored = load_archived_records()
+        january = load_archived_records(start=datetime(2024, 1, 10), end=datetime(2024, 2, 1))
+
+    assert [record["created_at"] for record in restored] == [date.isoformat() for date in reversed(old)]
+    assert all(record["archived"] and record["tier"] == "rules" for record in restored)
+    assert [record["created_at"] for record in january] == ["2024-01-20T00:00:00"]
+
+
+def test_overlapping_runs_do_not_duplicate_archives(app, monkeypatch):
+    _add_records(app, [datetime(2024, 1, 5), datetime(2024, 1, 20)])
+
+    compress = archive._compress
+    competing = []
+
+    def compress_while_another_run_finishes(data):
+        # Another run archives the same rows while this one is compressing them
+        if not competing:
+            competing.append(True)
+            thread = threading.Thread(target=_run_archive, args=(app, competing))
+            thread.start()
+            thread.join()
+        return compress(data)
+
+    monkeypatch.setattr(archive, "_compress", compress_while_another_run_finishes)
+
+    with app.app_context():
+        assert archive_old_records(older_than_days=90) == 0
+        assert competing[-1] == 2
+        assert HeadacheRecord.query.count() == 0
+        assert [batch.record_count for batch in HeadacheArchive.query.all()] == [2]
+
+
+def _run_archive(app, results):
+    with app.app_context():
+        results.append(archive_old_records(older_than_days=90))
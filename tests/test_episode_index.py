@@ -0,0 +1,77 @@
+import json
+
+from models import db, HeadacheRecord
+
+
+def _add_record(app, symptoms):
+    with app.app_context():
+        record = HeadacheRecord(symptoms=symptoms, diagnosis=f"diagnosis for {symptoms}",
+                                recommendations=json.dumps([]), tier="rules")
+        db.session.add(record)
+        db.session.commit()
+        return record.id
+
+
+def test_catch_up_finds_records_inserted_by_other_workers(app):
+    from app import episode_index, find_similar_episodes
+
+    with app.app_context():
+        episode_index.rebuild()
+        # Inserted directly, as another worker would, without episode_index.add()
+        record_id = _add_record(app, "pulsing pain behind the left eye with aura")
+        episodes = find_similar_episodes("aura behind the left eye", top_k=3)
+
+    assert [episode["id"] for episode in episodes] == [record_id]
+
+
+def test_archived_records_are_dropped_and_holes_compacted(app):
+    from app import episode_index, find_similar_episodes
+
+    with app.app_context():
+        ids = [_add_record(app, f"dull pressure across the forehead day {i}") for i in range(8)]
+        episode_index.rebuild()
+
+        # Removed by another process, the index only learns about it at search time
+        HeadacheRecord.query.filter(HeadacheRecord.id.in_(ids[:4])).delete(synchronize_session=False)
+        db.session.commit()
+
+        episodes = find_similar_episodes("dull pressure across the forehead", top_k=4)
+
+    assert sorted(episode["id"] for episode in episodes) == ids[4:]
+    assert episode_index._holes == 0
+    assert episode_index._size == 4
+
+
+def test_records_from_other_workers_survive_a_local_insert(app, client):
+    from app import episode_index, find_similar_episodes
+
+    with app.app_context():
+        episode_index.rebuild()
+    # Another worker stores a record this worker has not loaded yet...
+    other_id = _add_record(app, "pulsing pain behind the left eye with aura")
+    # ...then this worker stores one with a higher id through /analyze (rules tier)
+    response = client.post("/analyze", json={
+        "symptoms": "tight band of pressure on both sides, dull and constant"
+    })
+    assert response.get_json()["tier"] == "rules"
+
+    with app.app_context():
+        episodes = find_similar_episodes("aura behind left eye", top_k=3)
+
+    assert [episode["id"] for episode in episodes] == [other_id]
+
+
+def test_catch_up_works_through_a_backlog_one_batch_at_a_time(app):
+    from episode_index import EpisodeIndex
+
+    index = EpisodeIndex(batch_size=2)
+    with app.app_context():
+        index.rebuild()
+        ids = [_add_record(app, f"throbbing temple pain day {i}") for i in range(5)]
+        index.add(ids[-1], "throbbing temple pain day 4")
+
+        for _ in range(3):
+            index.catch_up()
+
+    assert sorted(index._positions) == ids
+    assert index._last_id == ids[-1]
@@ -0,0 +1,141 @@
+import json
+import time
+import types
+
+from openai import APITimeoutError
+
+from headache_rag import HeadacheRAG
+from knowledge_base import MedicalKnowledgeBase
+
+# Too vague for the rule scorer, so it escalates to the LLM
+AMBIGUOUS_SYMPTOMS = "my head hurts"
+
+
+class FakeTimeout(APITimeoutError):
+    """APITimeoutError without the underlying HTTP request object"""
+
+    def __init__(self):
+        Exception.__init__(self, "Request timed out.")
+
+
+class FakeOpenAI:
+    """Stand-in OpenAI client with scripted latencies"""
+
+    def __init__(self, embed_delay, generate_delays, timeout=None, calls=None, embed_calls=None):
+        self.embed_delay = embed_delay
+        self.generate_delays = generate_delays
+        self.timeout = timeout
+        self.calls = calls if calls is not None else []
+        self.embed_calls = embed_calls if embed_calls is not None else []
+        self.embeddings = types.SimpleNamespace(create=self._embed)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._generate))
+
+    def with_options(self, timeout, max_retries):
+        return FakeOpenAI(self.embed_delay, self.generate_delays, timeout, self.calls, self.embed_calls)
+
+    def _embed(self, **kwargs):
+        self.embed_calls.append(self.timeout)
+        time.sleep(self.embed_delay)
+        return types.SimpleNamespace(data=[types.SimpleNamespace(embedding=[0.1] * 1536)])
+
+    def _generate(self, **kwargs):
+        call = len(self.calls)
+        self.calls.append(self.timeout)
+        delay = self.generate_delays[min(call, len(self.generate_delays) - 1)]
+        if delay > self.timeout:
+            time.sleep(self.timeout)
+            raise FakeTimeout()
+        time.sleep(delay)
+        content = json.dumps({"diagnosis": f"llm answer {call}", "recommendations": []})
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+
+def _rag(monkeypatch, embed_delay=0.01, generate_delays=(0.01,)):
+    monkeypatch.setenv("ANALYZE_DEADLINE_SECONDS", "1")
+    monkeypatch.setenv("EMBED_TIMEOUT_SECONDS", "0.1")
+    monkeypatch.setenv("HEDGE_DELAY_SECONDS", "0.2")
+    rag = HeadacheRAG(MedicalKnowledgeBase())
+    rag.openai_client = FakeOpenAI(embed_delay, list(generate_delays))
+    return rag
+
+
+def test_hedged_request_wins_when_first_is_slow(monkeypatch):
+    rag = _rag(monkeypatch, embed_delay=0.01, generate_delays=[5, 0.05])
+
+    diagnosis, _, tier = rag.analyze_headache(AMBIGUOUS_SYMPTOMS)
+
+    assert tier == "llm"
+    assert diagnosis == "llm answer 1"
+    assert len(rag.openai_client.calls) == 2
+
+
+def test_deadline_returns_fallback_and_records_timeouts(monkeypatch):
+    rag = _rag(monkeypatch, embed_delay=0.5, generate_delays=[5])
+
+    start = time.monotonic()
+    diagnosis, _, tier = rag.analyze_headache(AMBIGUOUS_SYMPTOMS)
+    elapsed = time.monotonic() - start
+
+    assert tier == "fallback"
+    assert diagnosis.startswith("Based on the pattern matching analysis")
+    assert elapsed < 1.5
+
+    # Both timed-out calls feed the hedge percentile once they give up
+    time.sleep(1)
+    assert len(rag._generate_latencies) == 2
+
+
+def test_emergency_red_flags_answer_without_network_calls(monkeypatch):
+    rag = _rag(monkeypatch)
+
+    diagnosis, recommendations, tier = rag.analyze_headache("sudden worst headache of my life with stiff neck and fever")
+
+    assert tier == "emergency"
+    assert "IMMEDIATE medical attention" in diagnosis
+    assert recommendations[0] == "⚠️ SEEK EMERGENCY CARE IMMEDIATELY"
+    assert rag.openai_client.calls == []
+    assert rag.openai_client.embed_calls == []
+
+
+def test_high_margin_case_is_answered_by_rules(monkeypatch):
+    rag = _rag(monkeypatch)
+    symptoms = "tight band of pressure on both sides, dull and constant"
+
+    scores = rag.score_symptoms(symptoms)
+    assert scores["confidence"] >= rag.confidence_threshold
+    assert scores["top_count"] >= rag.min_rule_matches
+
+    diagnosis, _, tier = rag.analyze_headache(symptoms)
+
+    assert tier == "rules"
+    assert "tension headache" in diagnosis
+    assert rag.openai_client.calls == []
+    assert rag.openai_client.embed_calls == []
+
+
+def test_rule_thresholds_are_configurable(monkeypatch):
+    symptoms = "tight band of pressure on both sides, dull and constant"
+
+    monkeypatch.setenv("TIER_MIN_RULE_MATCHES", "50")
+    _, _, tier = _rag(monkeypatch).analyze_headache(symptoms)
+    assert tier == "llm"
+
+    monkeypatch.setenv("TIER_MIN_RULE_MATCHES", "3")
+    monkeypatch.setenv("TIER_CONFIDENCE_THRESHOLD", "1.01")
+    _, _, tier = _rag(monkeypatch).analyze_headache(symptoms)
+    assert tier == "llm"
+
+
+def test_ambiguous_input_escalates_to_llm(monkeypatch):
+    rag = _rag(monkeypatch)
+
+    # Migraine and cluster keywords tie, so the margin is zero
+    symptoms = "pain on one side"
+    assert rag.score_symptoms(symptoms)["confidence"] < rag.confidence_threshold
+
+    diagnosis, _, tier = rag.analyze_headache(symptoms)
+
+    assert tier == "llm"
+    assert diagnosis == "llm answer 0"
+    assert len(rag.openai_client.embed_calls) == 1
+    assert len(rag.openai_client.calls) == 1
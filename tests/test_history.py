@@ -0,0 +1,57 @@
+import json
+from datetime import datetime, timedelta
+
+from models import db, HeadacheRecord
+
+
+def test_history_range_accepts_utc_offsets(app, client):
+    with app.app_context():
+        db.session.add(HeadacheRecord(symptoms="neck pain", diagnosis="tension headache",
+                                      recommendations=json.dumps([]),
+                                      created_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+
+    response = client.get("/api/history", query_string={
+        "start": "2020-01-01T00:00:00+00:00",
+        "end": (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "include_archived": "1"
+    })
+
+    assert response.status_code == 200
+    assert len(response.get_json()["history"]) == 1
+
+
+def test_archiving_invalidates_if_modified_since(app, client):
+    from archive import archive_old_records
+
+    with app.app_context():
+        for days in (0, 200):
+            db.session.add(HeadacheRecord(symptoms="neck pain", diagnosis="tension headache",
+                                          recommendations=json.dumps([]),
+                                          created_at=datetime.utcnow() - timedelta(days=days, seconds=5)))
+        db.session.commit()
+
+    first = client.get("/api/history")
+    assert len(first.get_json()["history"]) == 2
+
+    with app.app_context():
+        assert archive_old_records(older_than_days=90) == 1
+
+    second = client.get("/api/history", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert second.status_code == 200
+    assert len(second.get_json()["history"]) == 1
+
+
+def test_tier_stats_report_escalation_rate(app, client):
+    with app.app_context():
+        for tier in ("emergency", "rules", "rules", "llm", "fallback", None):
+            db.session.add(HeadacheRecord(symptoms="headache", diagnosis="d",
+                                          recommendations=json.dumps([]), tier=tier))
+        db.session.commit()
+
+    stats = client.get("/api/stats/tiers").get_json()
+
+    assert stats["counts"] == {"emergency": 1, "rules": 2, "llm": 1, "fallback": 1, "unknown": 1}
+    # Records from before tiering are left out; llm + fallback escalated out of 5
+    assert stats["total"] == 5
+    assert stats["escalation_rate"] == 0.4
@@ -0,0 +1,81 @@
+import json
+
+from flask import url_for
+
+from models import db, HeadacheRecord
+
+
+def _add_records(app, count=20):
+    with app.app_context():
+        for i in range(count):
+            db.session.add(HeadacheRecord(
+                symptoms=f"Throbbing pain on one side of the head with nausea, episode {i}",
+                diagnosis="Based on the pattern matching analysis of your symptoms, "
+                          "your symptoms are consistent with a migraine.",
+                recommendations=json.dumps(["Rest in a quiet, dark room", "Stay well hydrated"]),
+                tier="rules"
+            ))
+        db.session.commit()
+
+
+def test_history_gzip_transfers_fewer_bytes(app, client):
+    _add_records(app)
+
+    raw = client.get("/api/history", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/api/history", headers={"Accept-Encoding": "gzip"})
+
+    assert raw.status_code == 200
+    assert "Content-Encoding" not in raw.headers
+    assert compressed.status_code == 200
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+
+    # Repetitive JSON shrinks to well under a quarter of its size
+    assert len(compressed.get_data()) * 4 < len(raw.get_data())
+
+
+def test_unchanged_history_returns_empty_304(app, client):
+    _add_records(app)
+
+    first = client.get("/api/history")
+    etag = first.headers["ETag"]
+    assert etag.startswith("W/")
+
+    second = client.get("/api/history", headers={"If-None-Match": etag})
+    assert len(first.get_data()) > 1000
+    assert second.status_code == 304
+    assert second.get_data() == b""
+
+    # A new record invalidates the cached copy
+    _add_records(app, count=1)
+    third = client.get("/api/history", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+
+
+def test_fingerprinted_static_is_cached_long_term(app, client):
+    with app.test_request_context():
+        url = url_for("static", filename="js/history.js")
+    assert "?v=" in url
+
+    response = client.get(url)
+    cache_control = response.headers["Cache-Control"]
+    assert response.status_code == 200
+    assert "max-age=31536000" in cache_control
+    assert "immutable" in cache_control
+    assert "no-cache" not in cache_control
+
+
+def test_compressed_static_revalidates_with_304(app, client):
+    with app.test_request_context():
+        url = url_for("static", filename="js/history.js")
+
+    first = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    etag = first.headers["ETag"]
+    # The tag names the file contents, not the compressed bytes
+    assert etag.startswith("W/")
+
+    second = client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.get_data() == b""
@@ -0,0 +1,32 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import RequestProfiler, worker_of
+
+
+def _slow_worker_task():
+    time.sleep(0.1)
+
+
+def test_slow_request_profile_includes_worker_threads(app):
+    profiler = RequestProfiler(sample_rate=0, slow_request_ms=50, interval_ms=5)
+    parent_thread_id = threading.get_ident()
+
+    def task():
+        with worker_of(parent_thread_id):
+            _slow_worker_task()
+
+    with app.test_request_context("/analyze", method="POST"):
+        profiler.start_request()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(task).result()
+        profiler.finish_request()
+
+    captures = profiler.list_captures()
+    assert len(captures) == 1
+    assert captures[0]["reason"] == "slow"
+
+    folded = profiler.folded(captures[0]["id"])
+    assert "[worker thread];" in folded
+    assert "test_profiling.py:_slow_worker_task" in folded
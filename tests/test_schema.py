@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from models import db
+from schema import missing_schema_changes, upgrade_schema
+
+# headache_record as it was created before the tier column and created_at index existed
+BASELINE_SCHEMA = """
+    CREATE TABLE headache_record (
+        id INTEGER NOT NULL PRIMARY KEY,
+        symptoms TEXT NOT NULL,
+        diagnosis TEXT NOT NULL,
+        recommendations TEXT NOT NULL,
+        created_at DATETIME,
+        used_fallback BOOLEAN
+    )
+"""
+
+
+def _baseline_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'baseline.db')}"
+    db.init_app(app)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text(BASELINE_SCHEMA))
+    return app
+
+
+def test_upgrade_adds_tier_column_and_created_at_index():
+    app = _baseline_app()
+
+    with app.app_context():
+        assert missing_schema_changes() == ["tier", "ix_headache_record_created_at"]
+        assert upgrade_schema() == ["tier", "ix_headache_record_created_at"]
+
+        inspector = inspect(db.engine)
+        assert "tier" in {column["name"] for column in inspector.get_columns("headache_record")}
+        assert "ix_headache_record_created_at" in {index["name"] for index in inspector.get_indexes("headache_record")}
+
+        # Safe to re-run
+        assert missing_schema_changes() == []
+        assert upgrade_schema() == []
+
+
+def test_upgrade_db_command_on_current_schema(app):
+    result = app.test_cli_runner().invoke(args=["upgrade-db"])
+
+    assert result.exit_code == 0
+    assert "up to date" in result.output
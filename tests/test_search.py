@@ -0,0 +1,21 @@
+import json
+
+from models import db, HeadacheRecord
+
+
+def test_search_after_creating_index(app, client):
+    result = app.test_cli_runner().invoke(args=["init-search-index"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        for symptoms in ("visual aura before the pain <b>", "stiff neck and shoulders"):
+            db.session.add(HeadacheRecord(symptoms=symptoms, diagnosis="unclear",
+                                          recommendations=json.dumps([])))
+        db.session.commit()
+
+    response = client.get("/api/history/search", query_string={"q": "aura"})
+    results = response.get_json()["results"]
+
+    assert response.status_code == 200
+    assert len(results) == 1
+    assert results[0]["symptoms_snippet"] == "visual <mark>aura</mark> before the pain &lt;b&gt;"